@@ -1,3 +1,4 @@
+import asyncio
 import json
 import logging
 import os
@@ -437,6 +438,12 @@ class OpenShape(commands.Bot):
         logger.info(f"Logged in as {self.user.name} ({self.user.id})")
         await self.tree.sync()
         logger.info(f"Character name: {self.character_name}")
+        
+        if hasattr(self, 'memory_manager') and self.memory_manager:
+            await asyncio.to_thread(
+                self.memory_manager.warm_collections,
+                [str(guild.id) for guild in self.guilds]
+            )
 
     async def close(self):
         self.config_manager.save_config()
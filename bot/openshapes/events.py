@@ -264,7 +264,7 @@ class MessageHandler:
                     channel_history = channel_history[-8:]
 
                 if hasattr(self.bot, 'memory_manager'):
-                    await self.bot.memory_manager.update_memory_from_conversation(
+                    self.bot.memory_manager.schedule_update_memory_from_conversation(
                         message.author.display_name, clean_content, response, guild_id
                     )
 
@@ -455,9 +455,9 @@ class ReactionHandler:
         
         guild_id = context.user_discord_id.split(":")[0] if ":" in context.user_discord_id else "global"
         if hasattr(self.bot, 'memory_manager'):
-            asyncio.create_task(self.bot.memory_manager.update_memory_from_conversation(
+            self.bot.memory_manager.schedule_update_memory_from_conversation(
                 context.user_name, context.user_message, response, guild_id
-            ))
+            )
     
     async def on_reaction_add(self, reaction: discord.Reaction, user: discord.User) -> None:
         if user.id == self.bot.user.id:
@@ -1,97 +1,168 @@
+import asyncio
+import functools
+import hashlib
+import json
 import logging
 import os
-import uuid
+import secrets
+import sqlite3
+import time
 import discord
+import numpy as np
+from collections import OrderedDict
+from contextlib import closing
 from typing import Optional, Any
 try:
     from openshapes.vectordb.vector_memory import ChromaMemoryManager
 except ImportError:
     from vectordb.vector_memory import ChromaMemoryManager
     
-logging.basicConfig(
-    level=logging.INFO, 
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger("openshape.chroma_integration")
 
-DEFAULT_SHARED_DB_PATH = os.path.join(os.getcwd(), "shared_memory")
+DEFAULT_SHARED_DB_PATH = None
+SLEEP_CONCURRENCY = int(os.environ.get("OPENSHAPE_SLEEP_CONCURRENCY", "2"))
+EDIT_CACHE_TTL = 5.0
+EXTRACTION_PROMPT_CHAR_BUDGET = 8000
+# Clamped so a zero or negative setting cannot stall or break the bucket.
+SLEEP_REQUESTS_PER_MINUTE = max(1.0, float(os.environ.get("OPENSHAPE_SLEEP_RPM", "120")))
+SLEEP_MAX_DURATION = float(os.environ.get("OPENSHAPE_SLEEP_MAX_SECONDS", "600"))
+SEEN_CONVERSATIONS_MAX = 4096
+WRITE_QUEUE_BATCH = 200
+WRITE_QUEUE_LINGER = 0.5
+MEMORABILITY_THRESHOLD = 0.2
+MEMORABILITY_WARMUP = 20
+MEMORABILITY_EMA_ALPHA = 0.1
 
 class MemorySystem:
-    def __init__(self, bot, shared_db_path: str = DEFAULT_SHARED_DB_PATH):
+    def __init__(self, bot, shared_db_path: Optional[str] = DEFAULT_SHARED_DB_PATH):
         self.bot = bot
-        self.shared_db_path = shared_db_path
+        self.shared_db_path = os.path.abspath(shared_db_path or os.path.join(os.getcwd(), "shared_memory"))
+        self.bot.shared_db_path = self.shared_db_path
         self.setup_bot_id()
         
     def setup_bot_id(self):
-        if not hasattr(self.bot, 'bot_id'):
-            if hasattr(self.bot, 'user') and hasattr(self.bot.user, 'id'):
-                self.bot.bot_id = f"bot_{self.bot.user.id}"
+        if 'bot_id' not in self.bot.__dict__:
+            user_id = getattr(getattr(self.bot, 'user', None), 'id', None)
+            if user_id is not None:
+                self.bot.bot_id = f"bot_{user_id}"
             else:
-                self.bot.bot_id = f"bot_{uuid.uuid4()}"
+                self.bot.bot_id = f"bot_{secrets.token_hex(6)}"
             
-            logger.info(f"Assigned bot ID: {self.bot.bot_id}")
+            logger.info("Assigned bot ID: %s", self.bot.bot_id)
     
     def setup(self) -> Optional[Any]:
         try:
             memory_manager = ChromaMemoryManager(self.bot, self.shared_db_path)
-            logger.info(f"Initialized ChromaDB memory manager for {self.bot.character_name}")
-            
-            self.bot.add_memory = memory_manager.add_memory
-            self.bot.remove_memory = memory_manager.remove_memory
-            self.bot.clear_memories = memory_manager.clear_memories
-            self.bot.search_memory = memory_manager.search_memory
-            self.bot.extract_memories_from_text = memory_manager.extract_memories_from_text
-            self.bot.update_memory_from_conversation = memory_manager.update_memory_from_conversation
-            self.bot.format_memories_for_display = memory_manager.format_memories_for_display
-            self.bot.update_memory = memory_manager.update_memory
-            
-            self.bot.memory_manager = memory_manager
-            self.bot.long_term_memory = {}
+            logger.info("Initialized ChromaDB memory manager for %s", self.bot.character_name)
+            
+            self.bot.__dict__.update({
+                'add_memory': memory_manager.add_memory,
+                'remove_memory': memory_manager.remove_memory,
+                'clear_memories': memory_manager.clear_memories,
+                'search_memory': memory_manager.search_memory,
+                'extract_memories_from_text': memory_manager.extract_memories_from_text,
+                'extract_memories_from_texts': memory_manager.extract_memories_from_texts,
+                'collect_memories_from_texts': memory_manager.collect_memories_from_texts,
+                'add_memories': memory_manager.add_memories,
+                'embed_batch': memory_manager.embed_batch,
+                'update_memory_from_conversation': memory_manager.update_memory_from_conversation,
+                'format_memories_for_display': memory_manager.format_memories_for_display,
+                'update_memory': memory_manager.update_memory,
+                'rename_memory': memory_manager.rename_memory,
+                'memory_manager': memory_manager,
+                'long_term_memory': {},
+            })
             
             return memory_manager
             
         except Exception as e:
-            logger.error(f"Failed to set up ChromaDB memory system: {e}")
+            logger.error("Failed to set up ChromaDB memory system: %s", e)
             self._setup_fallback_methods()
             return None
         
     def _setup_fallback_methods(self):
-        self.bot.add_memory = self._fallback_add
-        self.bot.remove_memory = self._fallback_remove
-        self.bot.clear_memories = self._fallback_clear
-        self.bot.search_memory = self._fallback_search
-        self.bot.extract_memories_from_text = self._fallback_extract
-        self.bot.update_memory_from_conversation = self._fallback_update
-        self.bot.format_memories_for_display = self._fallback_format
-        
-        self.bot.long_term_memory = {}
-        
-    def _fallback_search(self, *args, **kwargs):
-        logger.warning("Using fallback memory search because ChromaDB setup failed")
-        return []
-        
-    def _fallback_add(self, *args, **kwargs):
-        logger.warning("Using fallback memory add because ChromaDB setup failed")
-        return False
-        
-    def _fallback_remove(self, *args, **kwargs):
-        logger.warning("Using fallback memory remove because ChromaDB setup failed")
-        return False
-        
-    def _fallback_clear(self, *args, **kwargs):
-        logger.warning("Using fallback memory clear because ChromaDB setup failed")
-        return None
-        
-    async def _fallback_extract(self, *args, **kwargs):
-        logger.warning("Using fallback memory extract because ChromaDB setup failed")
-        return 0
-        
-    async def _fallback_update(self, *args, **kwargs):
-        logger.warning("Using fallback memory update because ChromaDB setup failed")
-        return None
-        
-    def _fallback_format(self, *args, **kwargs):
-        return "**Memory System Error**\nCould not initialize ChromaDB memory system."
+        self.bot.__dict__.update(_FALLBACKS, long_term_memory={})
+
+def _fallback_search(*args, **kwargs):
+    logger.warning("Using fallback memory search because ChromaDB setup failed")
+    return []
+    
+def _fallback_add(*args, **kwargs):
+    logger.warning("Using fallback memory add because ChromaDB setup failed")
+    return False
+    
+def _fallback_remove(*args, **kwargs):
+    logger.warning("Using fallback memory remove because ChromaDB setup failed")
+    return False
+    
+def _fallback_clear(*args, **kwargs):
+    logger.warning("Using fallback memory clear because ChromaDB setup failed")
+    return None
+    
+async def _fallback_extract(*args, **kwargs):
+    logger.warning("Using fallback memory extract because ChromaDB setup failed")
+    return 0
+    
+async def _fallback_extract_many(texts, *args, **kwargs):
+    logger.warning("Using fallback memory extract because ChromaDB setup failed")
+    return [0] * len(texts)
+    
+async def _fallback_collect_many(texts, *args, **kwargs):
+    logger.warning("Using fallback memory extract because ChromaDB setup failed")
+    return [[] for _ in texts]
+    
+def _fallback_add_many(*args, **kwargs):
+    logger.warning("Using fallback memory add because ChromaDB setup failed")
+    return 0
+    
+async def _fallback_update(*args, **kwargs):
+    logger.warning("Using fallback memory update because ChromaDB setup failed")
+    return None
+    
+def _fallback_format(*args, **kwargs):
+    return "**Memory System Error**\nCould not initialize ChromaDB memory system."
+
+_FALLBACKS = {
+    'add_memory': _fallback_add,
+    'remove_memory': _fallback_remove,
+    'clear_memories': _fallback_clear,
+    'search_memory': _fallback_search,
+    'extract_memories_from_text': _fallback_extract,
+    'extract_memories_from_texts': _fallback_extract_many,
+    'collect_memories_from_texts': _fallback_collect_many,
+    'add_memories': _fallback_add_many,
+    'update_memory_from_conversation': _fallback_update,
+    'format_memories_for_display': _fallback_format,
+}
+
+def _discord_len(text: str) -> int:
+    # Discord counts message length in UTF-16 code units, not code points.
+    return len(text.encode('utf-16-le')) // 2
+
+class DisplayPages:
+    def __init__(self, text: str, page_size: int = 1900):
+        self.buf = text.encode('utf-8')
+        self.spans = []
+        
+        start = 0
+        while start < len(self.buf):
+            end = min(len(self.buf), start + page_size)
+            if end < len(self.buf):
+                newline = self.buf.rfind(b'\n', start, end)
+                if newline > start + page_size // 2:
+                    end = newline + 1
+                else:
+                    while self.buf[end] & 0xC0 == 0x80:
+                        end -= 1
+            self.spans.append((start, end))
+            start = end
+            
+    def __len__(self):
+        return len(self.spans)
+        
+    def __getitem__(self, index):
+        start, end = self.spans[index]
+        return self.buf[start:end].decode('utf-8')
 
 class PaginationView(discord.ui.View):
     def __init__(self, chunks):
@@ -126,10 +197,11 @@ class PaginationView(discord.ui.View):
         )
 
 class MemoryAddModal(discord.ui.Modal):
-    def __init__(self, bot_instance, guild_id):
+    def __init__(self, bot_instance, guild_id, source_view=None):
         super().__init__(title="Add Memory Entry")
         self.bot = bot_instance
         self.guild_id = guild_id
+        self.source_view = source_view
         self.topic_input = discord.ui.TextInput(
             label="Topic:",
             placeholder="E.g., User Preferences, Recent Events",
@@ -152,6 +224,8 @@ class MemoryAddModal(discord.ui.Modal):
         source = modal_interaction.user.display_name
         
         success = self.bot.add_memory(topic, details, source, self.guild_id)
+        if success and self.source_view is not None:
+            self.source_view._edit_cache = None
         
         try:
             if success:
@@ -163,14 +237,15 @@ class MemoryAddModal(discord.ui.Modal):
                     "Failed to add memory. Check console for errors.", ephemeral=True
                 )
         except Exception as e:
-            logger.error(f"Error responding to interaction: {e}")
+            logger.error("Error responding to interaction: %s", e)
 
 class MemoryEditModal(discord.ui.Modal):
-    def __init__(self, bot_instance, topic, detail, guild_id):
+    def __init__(self, bot_instance, topic, detail, guild_id, source_view=None):
         super().__init__(title="Edit Memory")
         self.bot = bot_instance
         self.original_topic = topic
         self.guild_id = guild_id
+        self.source_view = source_view
         
         self.topic_input = discord.ui.TextInput(
             label="Topic:",
@@ -196,7 +271,9 @@ class MemoryEditModal(discord.ui.Modal):
         source = modal_interaction.user.display_name
         
         if new_topic != self.original_topic:
-            success = self.bot.add_memory(new_topic, new_detail, source, self.guild_id)
+            success = self.bot.rename_memory(self.original_topic, new_topic, new_detail, source, self.guild_id)
+            if success and self.source_view is not None:
+                self.source_view._edit_cache = None
             
             if success:
                 await modal_interaction.followup.send(
@@ -213,6 +290,8 @@ class MemoryEditModal(discord.ui.Modal):
                 success = self.bot.update_memory(new_topic, new_detail, source, self.guild_id)
             else:
                 success = self.bot.add_memory(new_topic, new_detail, source, self.guild_id)
+            if success and self.source_view is not None:
+                self.source_view._edit_cache = None
             
             if success:
                 await modal_interaction.followup.send(
@@ -225,191 +304,158 @@ class MemoryEditModal(discord.ui.Modal):
                     ephemeral=True
                 )
 
-class MemorySelectModal(discord.ui.Modal):
-    def __init__(self, bot_instance, memory_results, guild_id):
-        super().__init__(title="Select Memory to Edit")
+class MemorySelectView(discord.ui.View):
+    PAGE_SIZE = 25
+    
+    def __init__(self, bot_instance, memory_results, guild_id, source_view=None):
+        super().__init__()
         self.bot = bot_instance
-        self.memories = []
         self.guild_id = guild_id
+        self.source_view = source_view
+        # Same order as the memory display: newest first by ISO timestamp
+        # string, ties by topic, via two stable sorts with no date parsing.
+        metadatas = sorted(memory_results['metadatas'], key=lambda metadata: metadata.get('topic', 'Unknown Topic'))
+        metadatas.sort(key=lambda metadata: str(metadata.get('timestamp', '')), reverse=True)
+        self.memories = [
+            (metadata.get('topic', 'Unknown Topic'), metadata.get('detail', ''))
+            for metadata in metadatas
+        ]
+        self.page = 0
+        self.page_count = (len(self.memories) + self.PAGE_SIZE - 1) // self.PAGE_SIZE
+        
+        self.memory_select = discord.ui.Select(placeholder="Select a memory to edit")
+        self.memory_select.callback = self.on_select
+        self.add_item(self.memory_select)
+        
+        if self.page_count > 1:
+            self.previous_button = discord.ui.Button(label="⬅️ Previous", style=discord.ButtonStyle.secondary)
+            self.next_button = discord.ui.Button(label="Next ➡️", style=discord.ButtonStyle.secondary)
+            self.previous_button.callback = functools.partial(self.change_page, -1)
+            self.next_button.callback = functools.partial(self.change_page, 1)
+            self.add_item(self.previous_button)
+            self.add_item(self.next_button)
+            
+        self.update_options()
+        
+    def update_options(self):
+        start = self.page * self.PAGE_SIZE
+        self.memory_select.options = [
+            discord.SelectOption(label=topic[:100], value=str(i))
+            for i, (topic, _) in enumerate(self.memories[start:start + self.PAGE_SIZE], start)
+        ]
+        
+        if self.page_count > 1:
+            self.previous_button.disabled = (self.page == 0)
+            self.next_button.disabled = (self.page == self.page_count - 1)
+            
+    async def change_page(self, delta, button_interaction):
+        self.page = max(0, min(self.page_count - 1, self.page + delta))
+        self.update_options()
         
-        for i, metadata in enumerate(memory_results['metadatas']):
-            topic = metadata.get('topic', 'Unknown Topic')
-            detail = metadata.get('detail', '')
-            self.memories.append((topic, detail))
-        
-        topics = [memory[0] for memory in self.memories]
-        topic_options = "\n".join([f"{i+1}. {topic}" for i, topic in enumerate(topics)])
-        
-        self.topic_select = discord.ui.TextInput(
-            label=f"Enter number of memory to edit (1-{len(topics)})",
-            placeholder="Enter a number",
-            max_length=3
-        )
-        
-        self.topic_list = discord.ui.TextInput(
-            label="Available memories:",
-            style=discord.TextStyle.paragraph,
-            default=topic_options,
-            required=False
+        await button_interaction.response.edit_message(
+            content=f"Select a memory to edit. (Page {self.page + 1}/{self.page_count})",
+            view=self
         )
-        
-        self.add_item(self.topic_list)
-        self.add_item(self.topic_select)
     
-    async def on_submit(self, modal_interaction):
+    async def on_select(self, select_interaction):
         try:
-            try:
-                selection = int(self.topic_select.value) - 1
-                if selection < 0 or selection >= len(self.memories):
-                    await modal_interaction.response.send_message(
-                        f"Invalid selection. Please choose a number between 1 and {len(self.memories)}.",
-                        ephemeral=True
-                    )
-                    return
-            except ValueError:
-                await modal_interaction.response.send_message(
-                    "Please enter a valid number.",
-                    ephemeral=True
-                )
-                return
-                
-            selected_topic, selected_detail = self.memories[selection]
-            
-            view = discord.ui.View()
-            edit_button = discord.ui.Button(label=f"Edit: {selected_topic}", style=discord.ButtonStyle.primary)
-            
-            async def edit_button_callback(button_interaction):
-                edit_modal = MemoryEditModal(self.bot, selected_topic, selected_detail, self.guild_id)
-                await button_interaction.response.send_modal(edit_modal)
-                
-            edit_button.callback = edit_button_callback
-            view.add_item(edit_button)
-            
-            await modal_interaction.response.send_message(
-                f"Selected memory: **{selected_topic}**\n\nClick the button below to edit this memory.", 
-                view=view,
-                ephemeral=True
-            )
+            selected_topic, selected_detail = self.memories[int(self.memory_select.values[0])]
+            edit_modal = MemoryEditModal(self.bot, selected_topic, selected_detail, self.guild_id, self.source_view)
+            await select_interaction.response.send_modal(edit_modal)
             
         except Exception as e:
-            logger.error(f"Error in memory selection: {e}")
-            await modal_interaction.response.send_message(
+            logger.error("Error in memory selection: %s", e)
+            await select_interaction.response.send_message(
                 "An error occurred while selecting the memory.",
                 ephemeral=True
             )
 
+class ConfirmClearView(discord.ui.View):
+    def __init__(self, source_view):
+        super().__init__()
+        self.source_view = source_view
+        
+    @discord.ui.button(label="Yes, Clear All Memories", style=discord.ButtonStyle.danger)
+    async def confirm(self, confirm_interaction: discord.Interaction, _: discord.ui.Button):
+        self.source_view.bot.clear_memories(self.source_view.guild_id)
+        self.source_view._edit_cache = None
+        await confirm_interaction.response.send_message("All memories cleared!", ephemeral=True)
+        
+    @discord.ui.button(label="Cancel", style=discord.ButtonStyle.secondary)
+    async def cancel(self, cancel_interaction: discord.Interaction, _: discord.ui.Button):
+        await cancel_interaction.response.send_message("Memory clear canceled", ephemeral=True)
+
+async def _cb_add(view, button_interaction):
+    modal = MemoryAddModal(view.bot, view.guild_id, view)
+    await button_interaction.response.send_modal(modal)
+
+async def _cb_edit(view, button_interaction):
+    try:
+        now = time.monotonic()
+        if view._edit_cache is not None and now - view._edit_cache_at < EDIT_CACHE_TTL:
+            results = view._edit_cache
+        else:
+            collection = view.bot.memory_manager.get_collection_for_guild(view.guild_id)
+            results = collection.get(include=["metadatas"])
+            view._edit_cache = results
+            view._edit_cache_at = now
+        
+        if not results or not results['metadatas'] or len(results['metadatas']) == 0:
+            await button_interaction.response.send_message("No memories available to edit.", ephemeral=True)
+            return
+            
+        select_view = MemorySelectView(view.bot, results, view.guild_id, view)
+        content = "Select a memory to edit."
+        if select_view.page_count > 1:
+            content += f" (Page 1/{select_view.page_count})"
+        await button_interaction.response.send_message(content, view=select_view, ephemeral=True)
+        
+    except Exception as e:
+        logger.error("Error fetching memories for edit: %s", e)
+        await button_interaction.response.send_message("Failed to retrieve memories for editing.", ephemeral=True)
+
+async def _cb_clear(view, button_interaction):
+    await button_interaction.response.send_message(
+        "⚠️ **Warning**: This will delete ALL memories for this character.\nAre you sure?", 
+        view=ConfirmClearView(view), 
+        ephemeral=True
+    )
+
 class MemoryManagementView(discord.ui.View):
     def __init__(self, bot_instance, guild_id):
         super().__init__()
         self.bot = bot_instance
         self.guild_id = guild_id
+        self._edit_cache = None
+        self._edit_cache_at = 0.0
         
     @discord.ui.button(label="Add Memory", style=discord.ButtonStyle.primary)
     async def add_memory(self, button_interaction: discord.Interaction, _: discord.ui.Button):
-        modal = MemoryAddModal(self.bot, self.guild_id)
-        await button_interaction.response.send_modal(modal)
+        await _cb_add(self, button_interaction)
     
     @discord.ui.button(label="Edit Memory", style=discord.ButtonStyle.secondary)
     async def edit_memory(self, button_interaction: discord.Interaction, _: discord.ui.Button):
-        try:
-            collection = self.bot.memory_manager.get_collection_for_guild(self.guild_id)
-            results = collection.get()
-            
-            if not results or not results['metadatas'] or len(results['metadatas']) == 0:
-                await button_interaction.response.send_message("No memories available to edit.", ephemeral=True)
-                return
-                
-            modal = MemorySelectModal(self.bot, results, self.guild_id)
-            await button_interaction.response.send_modal(modal)
-            
-        except Exception as e:
-            logger.error(f"Error fetching memories for edit: {e}")
-            await button_interaction.response.send_message("Failed to retrieve memories for editing.", ephemeral=True)
+        await _cb_edit(self, button_interaction)
 
     @discord.ui.button(label="Clear All Memory", style=discord.ButtonStyle.danger)
     async def clear_memory(self, button_interaction: discord.Interaction, _: discord.ui.Button):
-        confirm_view = discord.ui.View()
-        
-        confirm_button = discord.ui.Button(label="Yes, Clear All Memories", style=discord.ButtonStyle.danger)
-        cancel_button = discord.ui.Button(label="Cancel", style=discord.ButtonStyle.secondary)
-        
-        async def confirm_callback(confirm_interaction):
-            self.bot.clear_memories(self.guild_id)
-            await confirm_interaction.response.send_message("All memories cleared!", ephemeral=True)
-            
-        async def cancel_callback(cancel_interaction):
-            await cancel_interaction.response.send_message("Memory clear canceled", ephemeral=True)
-            
-        confirm_button.callback = confirm_callback
-        cancel_button.callback = cancel_callback
-        
-        confirm_view.add_item(confirm_button)
-        confirm_view.add_item(cancel_button)
-        
-        await button_interaction.response.send_message(
-            "⚠️ **Warning**: This will delete ALL memories for this character.\nAre you sure?", 
-            view=confirm_view, 
-            ephemeral=True
-        )
+        await _cb_clear(self, button_interaction)
 
 class CombinedView(PaginationView):
     def __init__(self, chunks, bot_instance, guild_id):
         super().__init__(chunks)
         self.bot = bot_instance
         self.guild_id = guild_id
+        self._edit_cache = None
+        self._edit_cache_at = 0.0
         
         add_button = discord.ui.Button(label="Add Memory", style=discord.ButtonStyle.primary, row=1)
         edit_button = discord.ui.Button(label="Edit Memory", style=discord.ButtonStyle.secondary, row=1)
         clear_button = discord.ui.Button(label="Clear All Memory", style=discord.ButtonStyle.danger, row=1)
         
-        async def add_callback(button_interaction):
-            modal = MemoryAddModal(self.bot, self.guild_id)
-            await button_interaction.response.send_modal(modal)
-            
-        async def edit_callback(button_interaction):
-            try:
-                collection = self.bot.memory_manager.get_collection_for_guild(self.guild_id)
-                results = collection.get()
-                
-                if not results or not results['metadatas'] or len(results['metadatas']) == 0:
-                    await button_interaction.response.send_message("No memories available to edit.", ephemeral=True)
-                    return
-                    
-                modal = MemorySelectModal(self.bot, results, self.guild_id)
-                await button_interaction.response.send_modal(modal)
-                
-            except Exception as e:
-                logger.error(f"Error fetching memories for edit: {e}")
-                await button_interaction.response.send_message("Failed to retrieve memories for editing.", ephemeral=True)
-        
-        async def clear_callback(button_interaction):
-            confirm_view = discord.ui.View()
-            
-            confirm_button = discord.ui.Button(label="Yes, Clear All Memories", style=discord.ButtonStyle.danger)
-            cancel_button = discord.ui.Button(label="Cancel", style=discord.ButtonStyle.secondary)
-            
-            async def confirm_cb(confirm_interaction):
-                self.bot.clear_memories(self.guild_id)
-                await confirm_interaction.response.send_message("All memories cleared!", ephemeral=True)
-                
-            async def cancel_cb(cancel_interaction):
-                await cancel_interaction.response.send_message("Memory clear canceled", ephemeral=True)
-                
-            confirm_button.callback = confirm_cb
-            cancel_button.callback = cancel_cb
-            
-            confirm_view.add_item(confirm_button)
-            confirm_view.add_item(cancel_button)
-            
-            await button_interaction.response.send_message(
-                "⚠️ **Warning**: This will delete ALL memories for this character.\nAre you sure?", 
-                view=confirm_view, 
-                ephemeral=True
-            )
-        
-        add_button.callback = add_callback
-        edit_button.callback = edit_callback
-        clear_button.callback = clear_callback
+        add_button.callback = functools.partial(_cb_add, self)
+        edit_button.callback = functools.partial(_cb_edit, self)
+        clear_button.callback = functools.partial(_cb_clear, self)
         
         self.add_item(add_button)
         self.add_item(edit_button)
@@ -427,7 +473,7 @@ class MemoryCommand:
                 return await MemoryCommand._handle_owner_view(bot, interaction, guild_id)
                 
         except Exception as e:
-            logger.error(f"Error in memory command: {e}")
+            logger.error("Error in memory command: %s", e)
             
             try:
                 if not interaction.response.is_done():
@@ -438,16 +484,27 @@ class MemoryCommand:
             except Exception:
                 pass
     
+    @staticmethod
+    def _is_empty(bot, guild_id):
+        memory_manager = getattr(bot, 'memory_manager', None)
+        if memory_manager is None:
+            return False
+        return memory_manager.get_collection_for_guild(guild_id).count() == 0
+    
     @staticmethod
     async def _handle_user_view(bot, interaction, guild_id):
+        if MemoryCommand._is_empty(bot, guild_id):
+            await interaction.response.send_message("No memories stored yet.", ephemeral=True)
+            return
+            
         memory_display = bot.format_memories_for_display(guild_id)
         
-        if len(memory_display) <= 2000:
+        if _discord_len(memory_display) <= 2000:
             await interaction.response.send_message(memory_display, ephemeral=True)
         else:
             await interaction.response.defer(ephemeral=True)
             
-            chunks = [memory_display[i:i+1900] for i in range(0, len(memory_display), 1900)]
+            chunks = DisplayPages(memory_display)
             
             view = PaginationView(chunks)
             await interaction.followup.send(
@@ -459,14 +516,19 @@ class MemoryCommand:
     @staticmethod
     async def _handle_owner_view(bot, interaction, guild_id):
         view = MemoryManagementView(bot, guild_id)
+        
+        if MemoryCommand._is_empty(bot, guild_id):
+            await interaction.response.send_message("No memories stored yet.", view=view, ephemeral=True)
+            return
+            
         memory_display = bot.format_memories_for_display(guild_id)
         
-        if len(memory_display) <= 2000:
+        if _discord_len(memory_display) <= 2000:
             await interaction.response.send_message(memory_display, view=view, ephemeral=True)
         else:
             await interaction.response.defer(ephemeral=True)
             
-            chunks = [memory_display[i:i+1900] for i in range(0, len(memory_display), 1900)]
+            chunks = DisplayPages(memory_display)
             
             combined_view = CombinedView(chunks, bot, guild_id)
             await interaction.followup.send(
@@ -475,31 +537,262 @@ class MemoryCommand:
                 ephemeral=True
             )
 
+class AsyncTokenBucket:
+    def __init__(self, rate_per_sec: float, burst: int):
+        if rate_per_sec <= 0:
+            raise ValueError(f"Token bucket rate must be positive, got {rate_per_sec}")
+        self.rate = rate_per_sec
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+        
+    async def acquire(self):
+        while True:
+            async with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                    
+                wait = (1 - self.tokens) / self.rate
+                
+            # Sleep without holding the lock so other waiters can re-check.
+            await asyncio.sleep(wait)
+
+class SeenConversationCache:
+    _instances = {}
+    
+    def __init__(self, path: Optional[str], max_size: int = SEEN_CONVERSATIONS_MAX):
+        self.path = path
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self.entries.update(json.load(f))
+            except Exception as e:
+                logger.error("Error loading seen conversation cache: %s", e)
+                
+    @classmethod
+    def for_bot(cls, bot):
+        data_dir = getattr(bot, 'data_dir', None)
+        path = os.path.join(data_dir, "sleep_seen.json") if data_dir else None
+        cache = cls._instances.get(path)
+        if cache is None:
+            cache = cls._instances[path] = cls(path)
+        return cache
+        
+    @staticmethod
+    def key(text: str, guild_id: str) -> str:
+        return hashlib.sha256(f"{guild_id}\n{text}".encode("utf-8")).hexdigest()
+        
+    def __contains__(self, key):
+        return key in self.entries
+        
+    def add(self, key: str, created: int):
+        self.entries[key] = created
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            
+    def save(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(list(self.entries.items()), f)
+        except Exception as e:
+            logger.error("Error saving seen conversation cache: %s", e)
+
+class MemorabilityGate:
+    # Keeps a running centroid of conversations that produced memories and
+    # skips new ones that look nothing like them. Until enough examples have
+    # been seen every conversation is let through.
+    _instances = {}
+    
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.centroid = None
+        self.samples = 0
+        
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                self.centroid = np.asarray(data["centroid"], dtype=np.float32)
+                self.samples = data["samples"]
+            except Exception as e:
+                logger.error("Error loading memorability centroid: %s", e)
+                
+    @classmethod
+    def for_bot(cls, bot):
+        data_dir = getattr(bot, 'data_dir', None)
+        path = os.path.join(data_dir, "sleep_centroid.json") if data_dir else None
+        gate = cls._instances.get(path)
+        if gate is None:
+            gate = cls._instances[path] = cls(path)
+        return gate
+        
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+        
+    def accepts(self, embedding) -> bool:
+        if self.centroid is None or self.samples < MEMORABILITY_WARMUP:
+            return True
+        return float(np.dot(self._normalize(embedding), self._normalize(self.centroid))) >= MEMORABILITY_THRESHOLD
+        
+    def update(self, embedding):
+        embedding = self._normalize(embedding)
+        if self.centroid is None or self.centroid.shape != embedding.shape:
+            self.centroid = embedding
+        else:
+            self.centroid = (1 - MEMORABILITY_EMA_ALPHA) * self.centroid + MEMORABILITY_EMA_ALPHA * embedding
+        self.samples += 1
+        
+    def save(self):
+        if not self.path or self.centroid is None:
+            return
+        try:
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump({"centroid": self.centroid.tolist(), "samples": self.samples}, f)
+        except Exception as e:
+            logger.error("Error saving memorability centroid: %s", e)
+
+def _conversation_text(batch, character_name, prefixes, min_words=10):
+    # Decide from the raw message fields first, and only build the
+    # transcript for batches that have another speaker and enough words.
+    # prefixes caches the "Author: " line prefix for each participant.
+    saw_other_author = False
+    words = 0
+    
+    for msg in batch:
+        author = msg["author"]
+        if author != character_name:
+            saw_other_author = True
+            
+        prefix = prefixes.get(author)
+        if prefix is None:
+            prefix = prefixes[author] = f"{author}: "
+            
+        if words < min_words:
+            words += len(prefix.split(None, min_words - words - 1))
+        if words < min_words:
+            words += len(msg["content"].split(None, min_words - words - 1))
+            
+        if saw_other_author and words >= min_words:
+            break
+            
+    if not saw_other_author or words < min_words:
+        return None
+        
+    # The scan above may stop early, so authors after that point still need
+    # their prefix filled in here.
+    lines = []
+    for msg in batch:
+        author = msg["author"]
+        prefix = prefixes.get(author)
+        if prefix is None:
+            prefix = prefixes[author] = f"{author}: "
+        lines.append(prefix + msg["content"])
+        
+    return "\n".join(lines)
+
+def _group_texts(texts, budget=EXTRACTION_PROMPT_CHAR_BUDGET):
+    # Pack conversations into as few extraction prompts as fit the budget.
+    groups = []
+    current = []
+    size = 0
+    
+    for text in texts:
+        if current and size + len(text) > budget:
+            groups.append(current)
+            current = []
+            size = 0
+        current.append(text)
+        size += len(text)
+        
+    if current:
+        groups.append(current)
+        
+    return groups
+
+class SleepCursor:
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        if path:
+            # sqlite3's own context manager only commits; closing() releases
+            # the connection as well.
+            with closing(sqlite3.connect(path)) as conn, conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS sleep_cursor (channel_id INTEGER PRIMARY KEY, last_msg_id INTEGER)"
+                )
+        
+    @classmethod
+    def for_bot(cls, bot):
+        data_dir = getattr(bot, 'data_dir', None)
+        return cls(os.path.join(data_dir, "sleep_cursor.sqlite3") if data_dir else None)
+        
+    def get(self, channel_id: int) -> int:
+        if not self.path:
+            return 0
+        with closing(sqlite3.connect(self.path)) as conn, conn:
+            row = conn.execute(
+                "SELECT last_msg_id FROM sleep_cursor WHERE channel_id = ?", (channel_id,)
+            ).fetchone()
+        return row[0] if row else 0
+        
+    def set(self, channel_id: int, message_id: int):
+        if not self.path:
+            return
+        with closing(sqlite3.connect(self.path)) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sleep_cursor (channel_id, last_msg_id) VALUES (?, ?)",
+                (channel_id, message_id)
+            )
+
 class ConversationProcessor:
-    def __init__(self, bot, channel):
+    def __init__(self, bot, channel, after_id: int = 0):
         self.bot = bot
         self.channel = channel
+        self.after_id = after_id
+        self.latest_id = after_id
+        self.complete = True
         
-    async def extract_recent_memories(self, limit=30):
-        recent_messages = []
+    async def iter_recent_messages(self, limit=30):
         async for message in self.channel.history(limit=limit):
+            # Newest first: everything from here on was handled by an earlier run.
+            if message.id <= self.after_id:
+                break
+            self.latest_id = max(self.latest_id, message.id)
+            
             if message.author.bot and message.author.id != self.bot.user.id:
                 continue
             
-            recent_messages.append({
+            yield {
                 "author": message.author.display_name,
                 "content": message.content,
                 "id": message.id,
-                "timestamp": message.created_at.isoformat()
-            })
+                "timestamp": message.created_at.timestamp()
+            }
         
-        return recent_messages
+    async def extract_recent_memories(self, limit=30):
+        return [msg async for msg in self.iter_recent_messages(limit)]
         
     def batch_messages(self, messages):
         if not messages:
             return []
             
-        messages.sort(key=lambda m: m["timestamp"])
+        # channel.history defaults to oldest_first=False, so the list is in
+        # strict reverse-chronological order; drop this if that ever changes.
+        messages.reverse()
         
         batched_conversations = []
         current_batch = []
@@ -520,30 +813,117 @@ class ConversationProcessor:
             
         return batched_conversations
         
-    async def process_conversations(self, batched_conversations, guild_id):
-        memories_created = 0
+    def substantive_texts(self, batched_conversations):
+        character_name = self.bot.character_name
+        prefixes = {}
+        return [
+            text for text in (_conversation_text(batch, character_name, prefixes) for batch in batched_conversations)
+            if text is not None
+        ]
+        
+    async def process_texts(self, conversation_texts, guild_id):
+        seen_cache = SeenConversationCache.for_bot(self.bot)
+        conversation_texts = [
+            text for text in conversation_texts
+            if SeenConversationCache.key(text, guild_id) not in seen_cache
+        ]
+        if not conversation_texts:
+            return 0
+        
+        gate = MemorabilityGate.for_bot(self.bot)
+        embeddings = {}
+        embed_batch = getattr(self.bot, 'embed_batch', None)
+        if embed_batch and conversation_texts:
+            try:
+                # Only the gate reads these, and it renormalises in float32, so
+                # half precision is enough for vectors held across the whole run.
+                vectors = np.asarray(await asyncio.to_thread(embed_batch, conversation_texts), dtype=np.float16)
+                embeddings = {
+                    text: vector for text, vector in zip(conversation_texts, vectors)
+                    if gate.accepts(vector)
+                }
+                conversation_texts = [text for text in conversation_texts if text in embeddings]
+            except Exception as e:
+                logger.error("Error embedding conversations for memorability check: %s", e)
         
-        for batch in batched_conversations:
-            if all(msg["author"] == self.bot.character_name for msg in batch):
-                continue
-            
-            conversation_content = ""
-            for msg in batch:
-                conversation_content += f"{msg['author']}: {msg['content']}\n"
-            
-            if len(conversation_content.split()) < 10:
-                continue
-            
+        concurrency = getattr(self.bot, 'sleep_concurrency', SLEEP_CONCURRENCY)
+        semaphore = asyncio.Semaphore(concurrency)
+        bucket = AsyncTokenBucket(SLEEP_REQUESTS_PER_MINUTE / 60.0, concurrency)
+        deadline = time.monotonic() + SLEEP_MAX_DURATION
+        
+        async def extract(texts):
+            # Only wait for rate-limit tokens while the overall budget lasts;
+            # the bucket never sleeps when there is headroom.
+            await asyncio.wait_for(bucket.acquire(), max(0.0, deadline - time.monotonic()))
+            async with semaphore:
+                return texts, await self.bot.collect_memories_from_texts(texts)
+        
+        tasks = [asyncio.create_task(extract(group)) for group in _group_texts(conversation_texts)]
+        
+        queue = asyncio.Queue(maxsize=4)
+        writer = asyncio.create_task(self._write_memories(queue, guild_id, seen_cache, gate, embeddings))
+        
+        for next_result in asyncio.as_completed(tasks):
             try:
-                created = await self.bot.extract_memories_from_text(conversation_content, guild_id)
-                memories_created += created
-            except Exception as batch_error:
-                logger.error(f"Error processing conversation batch: {batch_error}")
+                await queue.put(await next_result)
+            except Exception as e:
+                logger.error("Error processing conversation batch: %r", e)
+                self.complete = False
+                
+        await queue.put(None)
+        memories_created = await writer
+        
+        seen_cache.save()
+        gate.save()
+        return memories_created
+        
+    async def _write_memories(self, queue, guild_id, seen_cache, gate, embeddings):
+        # Single consumer: drains finished extractions into one add_memories
+        # call per WRITE_QUEUE_BATCH memories or WRITE_QUEUE_LINGER seconds.
+        memories_created = 0
+        finished = False
+        
+        while not finished:
+            item = await queue.get()
+            if item is None:
+                break
+                
+            pending = [item]
+            pending_count = sum(len(m) for m in item[1])
+            linger_until = time.monotonic() + WRITE_QUEUE_LINGER
             
-            import asyncio
-            await asyncio.sleep(0.5)
+            while pending_count < WRITE_QUEUE_BATCH:
+                try:
+                    item = await asyncio.wait_for(queue.get(), max(0.0, linger_until - time.monotonic()))
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    finished = True
+                    break
+                pending.append(item)
+                pending_count += sum(len(m) for m in item[1])
+                
+            memories_created += await self._flush_memories(pending, guild_id, seen_cache, gate, embeddings)
             
         return memories_created
+        
+    async def _flush_memories(self, pending, guild_id, seen_cache, gate, embeddings):
+        memories = [memory for _, memory_sets in pending for text_memories in memory_sets for memory in text_memories]
+        
+        created = await asyncio.to_thread(self.bot.add_memories, memories, "Sleep Analysis", guild_id)
+        if created != len(memories):
+            self.complete = False
+            return created
+            
+        for texts, memory_sets in pending:
+            for text, text_memories in zip(texts, memory_sets):
+                seen_cache.add(SeenConversationCache.key(text, guild_id), len(text_memories))
+                if text_memories and text in embeddings:
+                    gate.update(embeddings[text])
+                    
+        return created
+
+_SLEEP_TASKS = set()
 
 class SleepCommand:
     @staticmethod
@@ -558,33 +938,48 @@ class SleepCommand:
         
         guild_id = str(interaction.guild.id) if interaction.guild else "global"
         
-        try:
-            await interaction.followup.send(f"{bot.character_name} is analyzing recent conversations and going to sleep...")
+        await interaction.followup.send(f"{bot.character_name} is analyzing recent conversations and going to sleep... I'll report back here when done.")
+        
+        task = asyncio.create_task(SleepCommand._run(bot, interaction.channel, guild_id))
+        _SLEEP_TASKS.add(task)
+        task.add_done_callback(_SLEEP_TASKS.discard)
         
-            processor = ConversationProcessor(bot, interaction.channel)
+    @staticmethod
+    async def _run(bot, channel, guild_id):
+        try:
+            # The cursor is a SQLite file, so its I/O stays off the event loop.
+            cursor = await asyncio.to_thread(SleepCursor.for_bot, bot)
+            
+            processor = ConversationProcessor(bot, channel, await asyncio.to_thread(cursor.get, channel.id))
             recent_messages = await processor.extract_recent_memories()
             
             if not recent_messages:
-                await interaction.followup.send("No recent messages found to analyze.")
+                await channel.send(f"{bot.character_name} has no new conversations to reflect on.")
                 return
                 
             batched_conversations = processor.batch_messages(recent_messages)
-            memories_created = await processor.process_conversations(batched_conversations, guild_id)
+            substantive_texts = processor.substantive_texts(batched_conversations)
+            
+            if not substantive_texts:
+                await asyncio.to_thread(cursor.set, channel.id, processor.latest_id)
+                await channel.send(f"{bot.character_name} looked over the new messages but found nothing substantial to reflect on.")
+                return
+                
+            memories_created = await processor.process_texts(substantive_texts, guild_id)
+            
+            if processor.complete and processor.latest_id > processor.after_id:
+                await asyncio.to_thread(cursor.set, channel.id, processor.latest_id)
             
             if memories_created > 0:
                 response = f"{bot.character_name} has processed the recent conversations and created {memories_created} new memories!"
             else:
                 response = f"{bot.character_name} analyzed the conversations but didn't find any significant information to remember."
                 
-            await interaction.followup.send(response)
+            await channel.send(response)
             
         except Exception as e:
-            logger.error(f"Error during sleep command: {e}")
-            
+            logger.exception("Error during sleep command")
             try:
-                await interaction.followup.send(f"Something went wrong while processing recent messages: {str(e)[:100]}...")
+                await channel.send(f"Something went wrong while processing recent messages: {str(e)[:100]}...")
             except Exception:
-                try:
-                    await interaction.channel.send(f"Error during sleep command: {str(e)[:100]}...")
-                except Exception:
-                    pass
\ No newline at end of file
+                logger.exception("Failed to report sleep command error")
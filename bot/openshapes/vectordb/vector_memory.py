@@ -1,12 +1,32 @@
+import asyncio
 import os
+import queue
 import json
 import logging
 import datetime
+import hashlib
+import heapq
 import uuid
-import re
+import sqlite3
+import threading
 import time
 import chromadb
-from typing import List
+import numpy as np
+from chromadb.utils import embedding_functions
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
+from typing import Any, Dict, List, Tuple
+try:
+    import orjson as _json
+except ImportError:
+    _json = json
+try:
+    import ijson
+    _STREAM_JSON_ERRORS = (ijson.JSONError,)
+except ImportError:
+    ijson = None
+    _STREAM_JSON_ERRORS = ()
 
 logging.basicConfig(
     level=logging.INFO, 
@@ -15,117 +35,265 @@ logging.basicConfig(
 logger = logging.getLogger("openshape.vector_memory")
 
 MAX_MEMORIES_PER_SERVER = 100
+EVICTION_SLACK = 10
+MEMORY_WRITE_BATCH_SIZE = 500
+EMBED_BATCH_SIZE = 32
+MIGRATION_BATCH_SIZE = 250
+# Schema 2 embeds the detail, prefixed with the topic only when the detail
+# does not already mention it; the topic itself lives in metadata.
+MEMORY_SCHEMA_VERSION = 2
+MEMORY_UPDATE_CONCURRENCY = 4
+MEMORY_QUEUE_SIZE = 1024
+MEMORY_QUEUE_BATCH = 200
+MEMORY_QUEUE_LINGER = 0.5
+SEARCH_CACHE_TTL = 30.0
+SEARCH_CACHE_SIZE = 128
+DISPLAY_CACHE_TTL = 30.0
+METADATA_PAGE_SIZE = 500
+WARMUP_WORKERS = 8
+ANALYSIS_CACHE_SIZE = 256
+
+_by_topic = itemgetter(0)
+_by_timestamp = itemgetter(3)
+
+def _iter_metadatas(collection, where=None):
+    # Pages through (id, metadata) rows so only one page of raw Chroma
+    # results is alive at a time.
+    offset = 0
+    while True:
+        results = collection.get(where=where, include=["metadatas"], limit=METADATA_PAGE_SIZE, offset=offset)
+        ids = results['ids']
+        yield from zip(ids, results['metadatas'] or [None] * len(ids))
+        if len(ids) < METADATA_PAGE_SIZE:
+            return
+        offset += METADATA_PAGE_SIZE
+
+def _json_span(text: str, opener: str, closer: str):
+    # Same span the greedy r'\[.*\]' (DOTALL) search picked out: first
+    # opener through last closer, found without any backtracking.
+    start = text.find(opener)
+    end = text.rfind(closer)
+    return text[start:end + 1] if start != -1 and end > start else None
+
+def _parse_json(text: str, opener: str, closer: str):
+    # The prompts ask for bare JSON and models mostly comply, so the whole
+    # reply is parsed first; the span is only cut out when that fails.
+    expected = list if opener == "[" else dict
+    try:
+        data = _json.loads(text)
+        if isinstance(data, expected):
+            return data
+    except (json.JSONDecodeError, TypeError):
+        pass
+    span = _json_span(text, opener, closer)
+    return _json.loads(span) if span else None
+
+_CLIENTS: Dict[str, Any] = {}
+_CLIENTS_LOCK = threading.Lock()
+
+def _tune_sqlite(client):
+    # Chroma does not expose its SQLite connection, so this reaches into the
+    # system database. Any layout change just leaves the defaults in place.
+    # Only WAL is set: it is stored in the database file, whereas
+    # per-connection pragmas would only reach this thread's connection out
+    # of Chroma's per-thread pool.
+    try:
+        from chromadb.db.impl.sqlite import SqliteDB
+        conn = client._system.instance(SqliteDB)._conn_pool.connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+    except Exception as e:
+        logger.warning("Could not enable WAL for ChromaDB: %s", e)
+
+def _get_shared_client(db_path: str):
+    db_path = os.path.abspath(db_path)
+    with _CLIENTS_LOCK:
+        client = _CLIENTS.get(db_path)
+        if client is None:
+            os.makedirs(db_path, exist_ok=True)
+            client = chromadb.PersistentClient(path=db_path)
+            _tune_sqlite(client)
+            _CLIENTS[db_path] = client
+            logger.info("Initialized shared ChromaDB client at %s", db_path)
+        return client
+
+_EMBEDDING_FUNCTION = None
+
+def _get_embedding_function():
+    # Collections are created without an explicit embedding function, so
+    # Chroma's default ONNX model is what they use internally as well.
+    global _EMBEDDING_FUNCTION
+    if _EMBEDDING_FUNCTION is None:
+        _EMBEDDING_FUNCTION = embedding_functions.DefaultEmbeddingFunction()
+    return _EMBEDDING_FUNCTION
+
+_last_timestamp = (0, "")
+
+def _timestamp() -> str:
+    # Eviction and display only order memories, so second resolution is
+    # enough, and the formatted string can be reused within that second.
+    global _last_timestamp
+    second = int(time.time())
+    if second != _last_timestamp[0]:
+        _last_timestamp = (second, datetime.datetime.fromtimestamp(second).isoformat())
+    return _last_timestamp[1]
+
+def _memory_metadata(topic: str, detail: str, source: str, guild_id: str, timestamp: str) -> Dict[str, Any]:
+    return {
+        "topic": topic,
+        "detail": detail,
+        "source": source,
+        "guild_id": guild_id,
+        "schema": MEMORY_SCHEMA_VERSION,
+        "timestamp": timestamp
+    }
+
+def _memory_text(value):
+    # Model output is untrusted: numbers are kept as text, anything else
+    # that is not a string is dropped so it cannot fail a whole batch.
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    return None
+
+def _analysis_key(system_prompt: str, text: str) -> bytes:
+    return hashlib.blake2b((system_prompt + '\x00' + text).encode(), digest_size=16).digest()
+
+def _memory_document(topic: str, detail: str) -> str:
+    # The topic lives in metadata; only embed it when the detail alone
+    # would lose it.
+    if topic.lower() in detail.lower():
+        return detail
+    return f"{topic}. {detail}"
+
+def _stable_bot_id(name: str) -> str:
+    # Kept on MD5 so bots that lose bot_id.txt land on their existing
+    # collections; it is only a name digest, hence usedforsecurity=False.
+    return "bot_" + hashlib.md5(name.encode(), usedforsecurity=False).hexdigest()[:12]
+
+def _write_bot_id(path: str, bot_id: str) -> None:
+    # The ID names the bot's collections, so a torn write would orphan them.
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(bot_id)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
 
 class SharedChromaManager:
-    _instance = None
-    _client = None
+    _instances: Dict[str, "SharedChromaManager"] = {}
     
     @classmethod
     def get_instance(cls, db_path: str = "shared_memory"):
-        if cls._instance is None:
-            cls._instance = cls(db_path)
-        return cls._instance
+        db_path = os.path.abspath(db_path)
+        instance = cls._instances.get(db_path)
+        if instance is None:
+            instance = cls._instances.setdefault(db_path, cls(db_path))
+        return instance
     
     def __init__(self, db_path: str):
-        if SharedChromaManager._client is not None:
-            self.client = SharedChromaManager._client
-            return
-            
-        os.makedirs(db_path, exist_ok=True)
-        
+        self._collections: Dict[str, chromadb.Collection] = {}
         try:
-            self.client = chromadb.PersistentClient(path=db_path)
-            SharedChromaManager._client = self.client
-            logger.info(f"Initialized shared ChromaDB client at {db_path}")
+            self.client = _get_shared_client(db_path)
         except Exception as e:
-            logger.error(f"Failed to initialize ChromaDB client: {e}")
+            logger.error("Failed to initialize ChromaDB client: %s", e)
             raise
     
     def get_collection_for_bot(self, collection_name: str, display_name: str) -> chromadb.Collection:
-        logger.info(f"Attempting to get/create collection {collection_name} for {display_name}")
-        
-        try:
-            collection_names = [coll for coll in self.client.list_collections()]
+        # Handles are cached per name, so the client is only asked once per
+        # collection; get_or_create does the existence check in the same call.
+        collection = self._collections.get(collection_name)
+        if collection is not None:
+            return collection
             
-            if collection_name in collection_names:
-                collection = self.client.get_collection(name=collection_name)
-                count = collection.count()
-                logger.info(f"Retrieved existing collection {collection_name} with {count} memories")
-                return collection
-            else:
-                collection = self.client.create_collection(
-                    name=collection_name,
-                    metadata={"display_name": display_name}
-                )
-                time.sleep(0.5)
-                logger.info(f"Created new collection {collection_name}")
-                return collection
-                
+        logger.info("Attempting to get/create collection %s for %s", collection_name, display_name)
+        try:
+            collection = self.client.get_or_create_collection(
+                name=collection_name,
+                metadata={"display_name": display_name}
+            )
         except Exception as e:
-            logger.error(f"Error getting/creating collection: {e}")
-            try:
-                collection = self.client.get_or_create_collection(
-                    name=collection_name,
-                    metadata={"display_name": display_name}
-                )
-                count = collection.count()
-                logger.info(f"Retrieved/created collection {collection_name} with {count} memories")
-                return collection
-            except Exception as nested_e:
-                logger.error(f"Second attempt failed: {nested_e}")
-                raise
+            logger.error("Error getting/creating collection: %s", e)
+            raise
+            
+        logger.info("Retrieved/created collection %s", collection_name)
+        return self._collections.setdefault(collection_name, collection)
+        
+    def get_existing_collection(self, collection_name: str):
+        # Like get_collection_for_bot, but never creates the collection;
+        # returns None when it does not exist yet.
+        collection = self._collections.get(collection_name)
+        if collection is not None:
+            return collection
+            
+        try:
+            collection = self.client.get_collection(name=collection_name)
+        except Exception:
+            return None
+        return self._collections.setdefault(collection_name, collection)
 
 class ChromaMemoryManager:
     def __init__(self, bot, shared_db_path: str = "shared_memory"):
         self.bot = bot
         self.guild_collections = {}
+        self._guild_counts = {}
+        self._search_cache: Dict[str, Dict[Tuple[str, int], Tuple[float, List[str]]]] = {}
+        self._display_cache: Dict[str, Tuple[float, str]] = {}
+        self._display_headers = None
+        self._topic_index: Dict[str, Dict[str, List[str]]] = {}
+        # Guards the topic index, the counters and the Chroma write that
+        # goes with them: writes arrive from worker threads, the event loop
+        # and the eviction thread. Reentrant because a rename can fall back
+        # to add_memory.
+        self._write_lock = threading.RLock()
+        self._analysis_cache: "OrderedDict[bytes, str]" = OrderedDict()
+        self._update_tasks = set()
+        self._update_semaphore = asyncio.Semaphore(MEMORY_UPDATE_CONCURRENCY)
+        self._write_queue = None
+        self._writer_task = None
+        self._evict_queue = queue.Queue()
+        self._evict_pending = set()
+        threading.Thread(target=self._evict_worker, name="memory-eviction", daemon=True).start()
         
-        if hasattr(bot, 'data_dir') and not os.path.exists(bot.data_dir):
+        if hasattr(bot, 'data_dir'):
             os.makedirs(bot.data_dir, exist_ok=True)
         
         stable_bot_id = None
+        persist_bot_id = False
         bot_id_file = os.path.join(bot.data_dir, "bot_id.txt") if hasattr(bot, 'data_dir') else None
         
-        if bot_id_file and os.path.exists(bot_id_file):
+        if bot_id_file:
             try:
                 with open(bot_id_file, 'r') as f:
                     stable_bot_id = f.read().strip()
-                    logger.info(f"Loaded existing bot ID from file: {stable_bot_id}")
+                    logger.info("Loaded existing bot ID from file: %s", stable_bot_id)
+            except FileNotFoundError:
+                pass
             except Exception as e:
-                logger.error(f"Error loading bot ID from file: {e}")
-        
-        if not stable_bot_id and hasattr(bot, 'character_name'):
-            import hashlib
-            name_hash = hashlib.md5(bot.character_name.encode()).hexdigest()[:12]
-            stable_bot_id = f"bot_{name_hash}"
-            logger.info(f"Generated stable bot ID from character name: {stable_bot_id}")
-            
-            if bot_id_file:
-                try:
-                    with open(bot_id_file, 'w') as f:
-                        f.write(stable_bot_id)
-                        logger.info(f"Saved stable bot ID to {bot_id_file}")
-                except Exception as e:
-                    logger.error(f"Error saving bot ID: {e}")
+                logger.error("Error loading bot ID from file: %s", e)
         
         if not stable_bot_id:
-            if hasattr(bot, 'user') and bot.user is not None and hasattr(bot.user, 'id'):
+            if hasattr(bot, 'character_name'):
+                stable_bot_id = _stable_bot_id(bot.character_name)
+                persist_bot_id = True
+                logger.info("Generated stable bot ID from character name: %s", stable_bot_id)
+            elif hasattr(bot, 'user') and bot.user is not None and hasattr(bot.user, 'id'):
                 stable_bot_id = f"bot_{bot.user.id}"
-                logger.info(f"Using Discord bot ID: {stable_bot_id}")
+                logger.info("Using Discord bot ID: %s", stable_bot_id)
             else:
-                stable_bot_id = f"bot_{uuid.uuid4()}"
-                logger.info(f"Generated new bot ID: {stable_bot_id}")
-                
-                if bot_id_file:
-                    try:
-                        with open(bot_id_file, 'w') as f:
-                            f.write(stable_bot_id)
-                            logger.info(f"Saved new bot ID to {bot_id_file}")
-                    except Exception as e:
-                        logger.error(f"Error saving bot ID: {e}")
+                stable_bot_id = f"bot_{uuid.uuid4().hex}"
+                persist_bot_id = True
+                logger.info("Generated new bot ID: %s", stable_bot_id)
+        
+        if persist_bot_id and bot_id_file:
+            try:
+                _write_bot_id(bot_id_file, stable_bot_id)
+                logger.info("Saved bot ID to %s", bot_id_file)
+            except Exception as e:
+                logger.error("Error saving bot ID: %s", e)
         
         bot.bot_id = stable_bot_id
-        logger.info(f"Initializing ChromaMemoryManager for {bot.character_name} with stable ID {bot.bot_id}")
+        logger.info("Initializing ChromaMemoryManager for %s with stable ID %s", bot.character_name, bot.bot_id)
         
         self.chroma_manager = SharedChromaManager.get_instance(shared_db_path)
         
@@ -135,24 +303,26 @@ class ChromaMemoryManager:
                 collection_name,
                 bot.character_name
             )
-            logger.info(f"Successfully connected to global collection with {self.collection.count()} memories")
+            global_count = self.collection.count()
+            logger.info("Successfully connected to global collection with %s memories", global_count)
         except Exception as e:
-            logger.error(f"Failed to get/create global collection: {e}")
+            logger.error("Failed to get/create global collection: %s", e)
             raise
         
         self.memory_path = os.path.join(bot.data_dir, "memory.json") if hasattr(bot, 'data_dir') else None
         
-        if self.memory_path and os.path.exists(self.memory_path):
-            self._migrate_legacy_memories()
+        if self.memory_path:
+            self._migrate_legacy_memories(initial_count=global_count)
     
     def get_collection_for_guild(self, guild_id: str) -> chromadb.Collection:
         if guild_id == "global":
             return self.collection
             
-        if guild_id in self.guild_collections:
-            return self.guild_collections[guild_id]
+        collection = self.guild_collections.get(guild_id)
+        if collection is not None:
+            return collection
             
-        collection_name = f"{self.bot.bot_id}_guild_{guild_id}".replace('-', '_')
+        collection_name = self._guild_collection_name(guild_id)
         display_name = f"{self.bot.character_name} (Guild: {guild_id})"
         
         try:
@@ -162,236 +332,342 @@ class ChromaMemoryManager:
             )
             
             self.guild_collections[guild_id] = collection
-            logger.info(f"Created/retrieved collection for guild {guild_id} with {collection.count()} memories")
+            logger.info("Created/retrieved collection for guild %s", guild_id)
             return collection
         except Exception as e:
-            logger.error(f"Error accessing collection for guild {guild_id}: {e}")
+            logger.error("Error accessing collection for guild %s: %s", guild_id, e)
             return self.collection
 
-    def _enforce_memory_limit(self, collection, guild_id: str):
-        try:
-            count = collection.count()
+    def _guild_collection_name(self, guild_id: str) -> str:
+        return f"{self.bot.bot_id}_guild_{guild_id}".replace('-', '_')
+        
+    def _warm_collection(self, guild_id: str) -> bool:
+        collection = self.chroma_manager.get_existing_collection(self._guild_collection_name(guild_id))
+        if collection is None:
+            return False
+        self.guild_collections.setdefault(guild_id, collection)
+        return True
+        
+    def warm_collections(self, guild_ids: List[str]) -> None:
+        # Only guilds that already have memories are opened; the rest still
+        # get their collection created on first use.
+        pending = [guild_id for guild_id in guild_ids if guild_id not in self.guild_collections]
+        if not pending:
+            return
             
-            if count <= MAX_MEMORIES_PER_SERVER:
-                return
+        with ThreadPoolExecutor(max_workers=WARMUP_WORKERS) as executor:
+            warmed = sum(executor.map(self._warm_collection, pending))
+        logger.info("Warmed %s of %s guild collections", warmed, len(pending))
             
-            results = collection.get()
+    def _invalidate_caches(self, guild_id: str):
+        # Called from writer threads while searches fill the caches on the
+        # event loop, so each guild's entry is dropped with a single pop
+        # rather than by iterating a shared dict.
+        self._display_cache.pop(guild_id, None)
+        self._search_cache.pop(guild_id, None)
             
-            if not results or not results['metadatas'] or len(results['metadatas']) == 0:
-                return
+    def _topic_ids(self, collection, guild_id: str) -> Dict[str, List[str]]:
+        # topic -> memory ids for a guild, built from one metadata fetch and
+        # then kept in step by the write paths. Eviction drops it instead.
+        index = self._topic_index.get(guild_id)
+        if index is None:
+            index = {}
+            for memory_id, metadata in _iter_metadatas(collection):
+                topic = (metadata or {}).get('topic')
+                if topic:
+                    index.setdefault(topic, []).append(memory_id)
+            self._topic_index[guild_id] = index
+        return index
+        
+    def _bump_memory_count(self, collection, guild_id: str, delta: int) -> int:
+        count = self._guild_counts.get(guild_id)
+        if count is None:
+            count = collection.count()
+        else:
+            count = max(0, count + delta)
+        self._guild_counts[guild_id] = count
+        return count
+        
+    def _schedule_eviction(self, collection, guild_id: str):
+        # Eviction runs on its own thread so writes return without waiting on it.
+        if guild_id in self._evict_pending:
+            return
+        self._evict_pending.add(guild_id)
+        self._evict_queue.put((collection, guild_id))
+        
+    def _evict_worker(self):
+        while True:
+            collection, guild_id = self._evict_queue.get()
+            self._evict_pending.discard(guild_id)
+            self._enforce_memory_limit(collection, guild_id)
+            
+    def _enforce_memory_limit(self, collection, guild_id: str):
+        try:
+            with self._write_lock:
+                count = collection.count()
+                self._guild_counts[guild_id] = count
                 
-            memories_with_time = []
-            for i, metadata in enumerate(results['metadatas']):
-                memory_id = results['ids'][i]
-                timestamp = metadata.get('timestamp', '1970-01-01T00:00:00')
+                if count <= MAX_MEMORIES_PER_SERVER:
+                    return
                 
-                try:
-                    dt = datetime.datetime.fromisoformat(timestamp)
-                    timestamp_value = dt.timestamp()
-                except (ValueError, TypeError):
-                    timestamp_value = 0
-                    
-                memories_with_time.append((memory_id, timestamp_value))
-            
-            memories_with_time.sort(key=lambda x: x[1])
-            
-            to_remove = count - MAX_MEMORIES_PER_SERVER
-            if to_remove <= 0:
-                return
+                # Evict a slack's worth below the limit so this runs every few
+                # inserts rather than on every one.
+                to_remove = count - MAX_MEMORIES_PER_SERVER + EVICTION_SLACK
+                if to_remove <= 0:
+                    return
                 
-            ids_to_remove = [m[0] for m in memories_with_time[:to_remove]]
-            
-            collection.delete(ids=ids_to_remove)
-            
-            logger.info(f"Removed {len(ids_to_remove)} oldest memories from guild {guild_id} to maintain limit of {MAX_MEMORIES_PER_SERVER}")
+                # Timestamps are all written by datetime.isoformat(), so comparing
+                # the strings orders them chronologically.
+                oldest = heapq.nsmallest(
+                    to_remove,
+                    _iter_metadatas(collection),
+                    key=lambda row: str((row[1] or {}).get('timestamp') or '')
+                )
+                ids_to_remove = [memory_id for memory_id, _ in oldest]
+                if not ids_to_remove:
+                    return
+                
+                collection.delete(ids=ids_to_remove)
+                self._guild_counts[guild_id] = count - len(ids_to_remove)
+                self._topic_index.pop(guild_id, None)
+                self._invalidate_caches(guild_id)
+                
+                logger.info("Removed %s oldest memories from guild %s to maintain limit of %s", len(ids_to_remove), guild_id, MAX_MEMORIES_PER_SERVER)
             
         except Exception as e:
-            logger.error(f"Error enforcing memory limit: {e}")
+            logger.error("Error enforcing memory limit: %s", e)
             
-    def _migrate_legacy_memories(self):
+    def _read_legacy_memories(self, f):
+        # ijson yields one topic at a time, so only a batch is held in memory;
+        # without it the whole file is parsed up front.
+        if ijson is not None:
+            return ijson.kvitems(f, '', use_float=True)
+        return _json.loads(f.read()).items()
+        
+    def _add_legacy_batch(self, entries, now: str) -> List[str]:
+        documents = [_memory_document(topic, detail) for topic, detail, _, _ in entries]
+        metadatas = [
+            _memory_metadata(topic, detail, source, "global", entry_timestamp or now)
+            for topic, detail, source, entry_timestamp in entries
+        ]
+        ids = [uuid.uuid4().hex for _ in entries]
+        
+        for attempt in range(2):
+            try:
+                self.collection.add(
+                    documents=documents,
+                    metadatas=metadatas,
+                    ids=ids
+                )
+                logger.info("Added batch of %s memories to global ChromaDB collection", len(documents))
+                return ids
+            except sqlite3.OperationalError as e:
+                if attempt:
+                    logger.error("Error adding memory batch: %s", e)
+                else:
+                    logger.warning("SQLite busy while adding memory batch, retrying: %s", e)
+            except Exception as e:
+                logger.error("Error adding memory batch: %s", e)
+                return []
+        return []
+        
+    def _rollback_legacy_migration(self, added_ids: List[str]):
+        # A partial import would stop the next start from retrying, since
+        # migration only runs into an empty collection.
+        for i in range(0, len(added_ids), MIGRATION_BATCH_SIZE):
+            self.collection.delete(ids=added_ids[i:i + MIGRATION_BATCH_SIZE])
+        logger.info("Rolled back %s migrated memories; %s is left in place", len(added_ids), self.memory_path)
+                
+    def _migrate_legacy_memories(self, initial_count: int):
         try:
-            if self.collection.count() > 0:
-                logger.info(f"Collection already has {self.collection.count()} memories, skipping migration")
+            try:
+                f = open(self.memory_path, "rb")
+            except FileNotFoundError:
                 return
                 
-            with open(self.memory_path, "r", encoding="utf-8") as f:
+            now = _timestamp()
+            added_ids = []
+            batch = []
+            with f:
+                if initial_count > 0:
+                    logger.info("Collection already has %s memories, skipping migration", initial_count)
+                    return
+                    
+                logger.info("Migrating legacy memories to ChromaDB global collection")
+                
                 try:
-                    legacy_memory = json.load(f)
-                except json.JSONDecodeError:
+                    for topic, memory_data in self._read_legacy_memories(f):
+                        if isinstance(memory_data, dict) and "detail" in memory_data:
+                            batch.append((topic, memory_data["detail"], memory_data.get("source", "Unknown"), memory_data.get("timestamp")))
+                        else:
+                            batch.append((topic, str(memory_data), "Unknown", None))
+                            
+                        if len(batch) >= MIGRATION_BATCH_SIZE:
+                            batch_ids = self._add_legacy_batch(batch, now)
+                            if not batch_ids:
+                                self._rollback_legacy_migration(added_ids)
+                                return
+                            added_ids.extend(batch_ids)
+                            batch = []
+                except (json.JSONDecodeError, *_STREAM_JSON_ERRORS):
+                    # With ijson the error can surface after earlier batches
+                    # were written, so those are removed again.
                     logger.error("Invalid JSON in memory file, skipping migration")
+                    self._rollback_legacy_migration(added_ids)
                     return
-            
-            if not legacy_memory:
+                    
+            if batch:
+                batch_ids = self._add_legacy_batch(batch, now)
+                if not batch_ids:
+                    self._rollback_legacy_migration(added_ids)
+                    return
+                added_ids.extend(batch_ids)
+                
+            migrated = len(added_ids)
+            if not migrated:
                 logger.info("No legacy memories to migrate")
                 return
-                
-            logger.info(f"Migrating {len(legacy_memory)} memories to ChromaDB global collection")
-            
-            documents = []
-            metadatas = []
-            ids = []
-            
-            for topic, memory_data in legacy_memory.items():
-                if isinstance(memory_data, dict) and "detail" in memory_data:
-                    document = f"{topic}: {memory_data['detail']}"
-                    metadata = {
-                        "topic": topic,
-                        "detail": memory_data["detail"],
-                        "source": memory_data.get("source", "Unknown"),
-                        "timestamp": memory_data.get("timestamp", datetime.datetime.now().isoformat()),
-                        "guild_id": "global"
-                    }
-                else:
-                    document = f"{topic}: {memory_data}"
-                    metadata = {
-                        "topic": topic,
-                        "detail": str(memory_data),
-                        "source": "Unknown",
-                        "timestamp": datetime.datetime.now().isoformat(),
-                        "guild_id": "global"
-                    }
-                
-                memory_id = str(uuid.uuid4())
-                documents.append(document)
-                metadatas.append(metadata)
-                ids.append(memory_id)
-            
-            batch_size = 100
-            for i in range(0, len(documents), batch_size):
-                batch_docs = documents[i:i+batch_size]
-                batch_meta = metadatas[i:i+batch_size]
-                batch_ids = ids[i:i+batch_size]
-                
-                if batch_docs:
-                    try:
-                        self.collection.add(
-                            documents=batch_docs,
-                            metadatas=batch_meta,
-                            ids=batch_ids
-                        )
-                        logger.info(f"Added batch of {len(batch_docs)} memories to global ChromaDB collection")
-                    except Exception as e:
-                        logger.error(f"Error adding memory batch: {e}")
             
             backup_path = f"{self.memory_path}.bak.{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}"
             os.rename(self.memory_path, backup_path)
-            logger.info(f"Successfully migrated {len(documents)} memories and backed up legacy file to {backup_path}")
+            logger.info("Successfully migrated %s memories and backed up legacy file to %s", migrated, backup_path)
             
         except Exception as e:
-            logger.error(f"Error migrating legacy memories: {e}")
+            logger.error("Error migrating legacy memories: %s", e)
             
     def add_memory(self, topic: str, detail: str, source: str, guild_id: str = "global") -> bool:
+        return self.add_memories([(topic, detail)], source, guild_id) == 1
+        
+    def update_memory(self, topic: str, new_detail: str, source: str, guild_id: str = "global") -> bool:
         try:
             collection = self.get_collection_for_guild(guild_id)
             
-            self._enforce_memory_limit(collection, guild_id)
-            
-            document = f"{topic}: {detail}"
-            
-            metadata = {
-                "topic": topic,
-                "detail": detail,
-                "source": source,
-                "guild_id": guild_id,
-                "timestamp": datetime.datetime.now().isoformat()
-            }
-            
-            memory_id = str(uuid.uuid4())
-            
-            collection.add(
-                documents=[document],
-                metadatas=[metadata],
-                ids=[memory_id]
-            )
-            
-            logger.info(f"Added memory for guild {guild_id} from {source}: {topic}: {detail}")
-            return True
+            with self._write_lock:
+                memory_ids = self._topic_ids(collection, guild_id).get(topic)
+                
+                if memory_ids:
+                    memory_id = memory_ids[0]
+                    
+                    document = _memory_document(topic, new_detail)
+                    metadata = _memory_metadata(topic, new_detail, source, guild_id, _timestamp())
+                    
+                    collection.update(
+                        ids=[memory_id],
+                        documents=[document],
+                        metadatas=[metadata]
+                    )
+                    self._invalidate_caches(guild_id)
+                    
+                    logger.info("Updated memory for guild %s: %s: %s", guild_id, topic, new_detail)
+                    return True
+                else:
+                    logger.info("No memory found with topic: %s in guild %s", topic, guild_id)
+                    return False
         except Exception as e:
-            logger.error(f"Error adding memory to ChromaDB: {e}")
+            logger.error("Error updating memory: %s", e)
             return False
-        
-    def update_memory(self, topic: str, new_detail: str, source: str, guild_id: str = "global") -> bool:
+            
+    def rename_memory(self, old_topic: str, new_topic: str, new_detail: str, source: str, guild_id: str = "global") -> bool:
         try:
             collection = self.get_collection_for_guild(guild_id)
             
-            results = collection.get(
-                where={"topic": topic}
-            )
-            
-            if results and results['ids'] and len(results['ids']) > 0:
-                memory_id = results['ids'][0]
+            with self._write_lock:
+                topic_ids = self._topic_ids(collection, guild_id)
+                memory_ids = topic_ids.get(old_topic)
                 
-                document = f"{topic}: {new_detail}"
+                if not memory_ids:
+                    logger.info("No memory found with topic: %s in guild %s, adding as new", old_topic, guild_id)
+                    return self.add_memory(new_topic, new_detail, source, guild_id)
                 
-                metadata = {
-                    "topic": topic,
-                    "detail": new_detail,
-                    "source": source,
-                    "guild_id": guild_id,
-                    "timestamp": datetime.datetime.now().isoformat()
-                }
+                memory_id = memory_ids[0]
+                metadata = _memory_metadata(new_topic, new_detail, source, guild_id, _timestamp())
                 
                 collection.update(
                     ids=[memory_id],
-                    documents=[document],
+                    documents=[_memory_document(new_topic, new_detail)],
                     metadatas=[metadata]
                 )
                 
-                logger.info(f"Updated memory for guild {guild_id}: {topic}: {new_detail}")
+                if len(memory_ids) > 1:
+                    collection.delete(ids=memory_ids[1:])
+                    self._bump_memory_count(collection, guild_id, 1 - len(memory_ids))
+                del topic_ids[old_topic]
+                topic_ids.setdefault(new_topic, []).append(memory_id)
+                self._invalidate_caches(guild_id)
+                
+                logger.info("Renamed memory for guild %s: %s -> %s", guild_id, old_topic, new_topic)
                 return True
-            else:
-                logger.info(f"No memory found with topic: {topic} in guild {guild_id}")
-                return False
         except Exception as e:
-            logger.error(f"Error updating memory: {e}")
+            logger.error("Error renaming memory: %s", e)
             return False
             
     def remove_memory(self, topic: str, guild_id: str = "global") -> bool:
         try:
             collection = self.get_collection_for_guild(guild_id)
             
-            results = collection.get(
-                where={"topic": topic}
-            )
-            
-            if results and results['ids'] and len(results['ids']) > 0:
-                collection.delete(
-                    ids=results['ids']
-                )
-                logger.info(f"Removed memory with topic: {topic} from guild {guild_id}")
-                return True
-            else:
-                logger.info(f"No memory found with topic: {topic} in guild {guild_id}")
-                return False
+            with self._write_lock:
+                memory_ids = self._topic_ids(collection, guild_id).pop(topic, None)
+                
+                if memory_ids:
+                    collection.delete(
+                        ids=memory_ids
+                    )
+                    self._bump_memory_count(collection, guild_id, -len(memory_ids))
+                    self._invalidate_caches(guild_id)
+                    logger.info("Removed memory with topic: %s from guild %s", topic, guild_id)
+                    return True
+                else:
+                    logger.info("No memory found with topic: %s in guild %s", topic, guild_id)
+                    return False
         except Exception as e:
-            logger.error(f"Error removing memory: {e}")
+            logger.error("Error removing memory: %s", e)
             return False
             
     def clear_memories(self, guild_id: str = "global") -> None:
         try:
             collection = self.get_collection_for_guild(guild_id)
             
-            results = collection.get()
-            
-            if results and results['ids'] and len(results['ids']) > 0:
-                collection.delete(
-                    ids=results['ids']
-                )
-                logger.info(f"Cleared all memories ({len(results['ids'])} entries) for {self.bot.character_name} in guild {guild_id}")
-            else:
-                logger.info(f"No memories to clear for {self.bot.character_name} in guild {guild_id}")
+            with self._write_lock:
+                if guild_id != "global" and collection is self.collection:
+                    # A guild whose own collection could not be opened writes
+                    # into the global one, so only its rows are removed there
+                    # and the shared index and counters are rebuilt on demand.
+                    ids = collection.get(where={"guild_id": guild_id}, include=[])['ids']
+                    if ids:
+                        collection.delete(ids=ids)
+                    for key in (guild_id, "global"):
+                        self._guild_counts.pop(key, None)
+                        self._topic_index.pop(key, None)
+                        self._invalidate_caches(key)
+                else:
+                    ids = collection.get(include=[])['ids']
+                    if ids:
+                        collection.delete(ids=ids)
+                    self._guild_counts[guild_id] = 0
+                    self._topic_index[guild_id] = {}
+                    self._invalidate_caches(guild_id)
+                    
+                if ids:
+                    logger.info("Cleared all memories (%s entries) for %s in guild %s", len(ids), self.bot.character_name, guild_id)
+                else:
+                    logger.info("No memories to clear for %s in guild %s", self.bot.character_name, guild_id)
                 
         except Exception as e:
-            logger.error(f"Error clearing memories: {e}")
+            logger.error("Error clearing memories: %s", e)
             
     def search_memory(self, query: str, guild_id: str = "global", limit: int = 5) -> List[str]:
         if not query or len(query.strip()) < 3:
             return []
             
+        key = (query.strip().lower(), limit)
+        cached_at, cached = self._search_cache.get(guild_id, {}).get(key, (0.0, None))
+        if cached is not None and time.monotonic() - cached_at < SEARCH_CACHE_TTL:
+            return list(cached)
+            
         try:
             collection = self.get_collection_for_guild(guild_id)
             
-            logger.info(f"Searching for memories related to: {query} in guild {guild_id}")
+            logger.info("Searching for memories related to: %s in guild %s", query, guild_id)
             results = collection.query(
                 query_texts=[query],
                 n_results=min(limit, 10)
@@ -408,20 +684,146 @@ class ChromaMemoryManager:
                     formatted_memory = f"{topic}: {detail} (from {source})"
                     memory_matches.append(formatted_memory)
                     
-            if memory_matches:
+            if memory_matches and logger.isEnabledFor(logging.INFO):
                 topics = [m.split(':')[0] for m in memory_matches]
-                logger.info(f"Found {len(memory_matches)} relevant memories for '{query}' in guild {guild_id}: {topics}")
+                logger.info("Found %s relevant memories for '%s' in guild %s: %s", len(memory_matches), query, guild_id, topics)
+            
+            guild_cache = self._search_cache.setdefault(guild_id, {})
+            if len(guild_cache) >= SEARCH_CACHE_SIZE:
+                del guild_cache[next(iter(guild_cache))]
+            guild_cache[key] = (time.monotonic(), memory_matches)
                 
-            return memory_matches
+            return list(memory_matches)
             
         except Exception as e:
-            logger.error(f"Error searching memories: {e}")
+            logger.error("Error searching memories: %s", e)
             return []
             
-    async def extract_memories_from_text(self, text_content: str, guild_id: str = "global") -> int:
+    def embed_batch(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+            
+        return np.asarray(self._embed_texts(texts), dtype=np.float32)
+        
+    def _embed_texts(self, texts: List[str]) -> list:
+        # Returned in whatever form the embedding function produces, which is
+        # also what collection.add accepts on every supported Chroma version.
+        embedding_function = _get_embedding_function()
+        embeddings = []
+        for i in range(0, len(texts), EMBED_BATCH_SIZE):
+            embeddings.extend(embedding_function(texts[i:i + EMBED_BATCH_SIZE]))
+        return embeddings
+        
+    def add_memories(self, memories: List[Tuple[str, str]], source: str, guild_id: str = "global") -> int:
+        if not memories:
+            return 0
+            
+        try:
+            collection = self.get_collection_for_guild(guild_id)
+            timestamp = _timestamp()
+            
+            # A topic repeated within the call keeps its last detail. The
+            # embedding does not depend on whether the topic is stored yet,
+            # so it is computed before taking the write lock.
+            items = list(dict(memories).items())
+            documents = [_memory_document(topic, detail) for topic, detail in items]
+            embeddings = self._embed_texts(documents)
+            
+            with self._write_lock:
+                topic_ids = self._topic_ids(collection, guild_id)
+                
+                # Topics that are already stored are rewritten in place
+                # rather than inserted again.
+                existing = []
+                new_memories = []
+                for (topic, detail), document, embedding in zip(items, documents, embeddings):
+                    memory_ids = topic_ids.get(topic)
+                    if memory_ids:
+                        existing.append((memory_ids[0], topic, detail, document, embedding))
+                    else:
+                        new_memories.append((topic, detail, document, embedding))
+                
+                if existing:
+                    collection.update(
+                        ids=[memory_id for memory_id, _, _, _, _ in existing],
+                        documents=[document for _, _, _, document, _ in existing],
+                        embeddings=[embedding for _, _, _, _, embedding in existing],
+                        metadatas=[_memory_metadata(topic, detail, source, guild_id, timestamp) for _, topic, detail, _, _ in existing]
+                    )
+                
+                # Single adds and small batches go out as-is; only oversized
+                # batches are sliced into MEMORY_WRITE_BATCH_SIZE chunks.
+                if len(new_memories) <= MEMORY_WRITE_BATCH_SIZE:
+                    batches = (new_memories,) if new_memories else ()
+                else:
+                    batches = (new_memories[i:i + MEMORY_WRITE_BATCH_SIZE] for i in range(0, len(new_memories), MEMORY_WRITE_BATCH_SIZE))
+                    
+                for batch in batches:
+                    ids = [uuid.uuid4().hex for _ in batch]
+                    collection.add(
+                        documents=[document for _, _, document, _ in batch],
+                        embeddings=[embedding for _, _, _, embedding in batch],
+                        metadatas=[_memory_metadata(topic, detail, source, guild_id, timestamp) for topic, detail, _, _ in batch],
+                        ids=ids
+                    )
+                    
+                    for (topic, _, _, _), memory_id in zip(batch, ids):
+                        topic_ids[topic] = [memory_id]
+                        
+                count = self._bump_memory_count(collection, guild_id, len(new_memories)) if new_memories else 0
+            self._invalidate_caches(guild_id)
+            
+            if count > MAX_MEMORIES_PER_SERVER + EVICTION_SLACK:
+                self._schedule_eviction(collection, guild_id)
+            
+            logger.info("Stored %s memories for guild %s from %s (%s new, %s updated)",
+                        len(memories), guild_id, source, len(new_memories), len(existing))
+            return len(memories)
+        except Exception as e:
+            logger.error("Error adding memories to ChromaDB: %s", e)
+            return 0
+            
+    async def _analyze(self, text: str, system_prompt: str):
+        # Retries and repeated conversations send the exact same prompt, so
+        # the last few hundred answers are reused instead of calling the API.
+        key = _analysis_key(system_prompt, text)
+        memory_analysis = self._analysis_cache.get(key)
+        if memory_analysis is not None:
+            self._analysis_cache.move_to_end(key)
+            return memory_analysis
+            
+        memory_analysis = await self.bot._call_chat_api(text, system_prompt=system_prompt)
+        if memory_analysis:
+            self._analysis_cache[key] = memory_analysis
+            if len(self._analysis_cache) > ANALYSIS_CACHE_SIZE:
+                self._analysis_cache.popitem(last=False)
+        return memory_analysis
+        
+    def _forget_analysis(self, text: str, system_prompt: str) -> None:
+        # Unusable answers (including the API's error fallback text) must
+        # not be replayed on retry.
+        self._analysis_cache.pop(_analysis_key(system_prompt, text), None)
+        
+    def _memory_candidates(self, memory_data) -> List[Tuple[str, str]]:
+        memories = []
+        
+        for memory in memory_data:
+            if not isinstance(memory, dict):
+                continue
+                
+            topic = _memory_text(memory.get("topic"))
+            detail = _memory_text(memory.get("detail"))
+            importance = memory.get("importance", 5)
+            
+            if topic and detail and isinstance(importance, (int, float)) and importance >= 3:
+                memories.append((topic, detail))
+        
+        return memories
+        
+    async def collect_memories_from_text(self, text_content: str) -> List[Tuple[str, str]]:
         if not hasattr(self.bot, 'api_integration') or not self.bot.api_integration.client or not self.bot.api_integration.chat_model:
             logger.warning("AI client or chat model not available for memory extraction")
-            return 0
+            return []
         
         try:
             system_prompt = """You are an AI designed to extract meaningful information from conversations or text that would be valuable to remember for future interactions.
@@ -450,44 +852,154 @@ class ChromaMemoryManager:
             
             if not hasattr(self.bot, '_call_chat_api'):
                 logger.error("Bot doesn't have _call_chat_api method")
-                return 0
+                return []
                 
-            memory_analysis = await self.bot._call_chat_api(
-                text_content,
-                system_prompt=system_prompt
-            )
+            memory_analysis = await self._analyze(text_content, system_prompt)
             
             try:
-                json_match = re.search(r'\[.*\]', memory_analysis, re.DOTALL)
+                memory_data = _parse_json(memory_analysis, "[", "]")
                 
-                if json_match:
-                    memory_json = json_match.group(0)
-                    memory_data = json.loads(memory_json)
-                    
-                    memories_created = 0
-                    
-                    for memory in memory_data:
-                        topic = memory.get("topic")
-                        detail = memory.get("detail")
-                        importance = memory.get("importance", 5)
-                        
-                        if topic and detail and importance >= 3:
-                            success = self.add_memory(topic, detail, "Sleep Analysis", guild_id)
-                            if success:
-                                memories_created += 1
-                    
-                    return memories_created
+                if memory_data is not None:
+                    return self._memory_candidates(memory_data)
                 else:
+                    self._forget_analysis(text_content, system_prompt)
                     logger.info("No memory-worthy information found in sleep analysis")
-                    return 0
+                    return []
                     
             except (json.JSONDecodeError, AttributeError) as e:
-                logger.warning(f"Failed to parse memory response in sleep: {memory_analysis[:100]}... Error: {str(e)}")
-                return 0
+                self._forget_analysis(text_content, system_prompt)
+                logger.warning("Failed to parse memory response in sleep: %s... Error: %s", memory_analysis[:100], e)
+                return []
                 
         except Exception as e:
-            logger.error(f"Error in sleep memory extraction: {e}")
-            return 0
+            logger.error("Error in sleep memory extraction: %s", e)
+            return []
+            
+    async def extract_memories_from_text(self, text_content: str, guild_id: str = "global") -> int:
+        memories = await self.collect_memories_from_text(text_content)
+        return await asyncio.to_thread(self.add_memories, memories, "Sleep Analysis", guild_id)
+        
+    async def collect_memories_from_texts(self, text_contents: List[str]) -> List[List[Tuple[str, str]]]:
+        if len(text_contents) == 1:
+            return [await self.collect_memories_from_text(text_contents[0])]
+            
+        if not hasattr(self.bot, 'api_integration') or not self.bot.api_integration.client or not self.bot.api_integration.chat_model:
+            logger.warning("AI client or chat model not available for memory extraction")
+            return [[] for _ in text_contents]
+        
+        if not hasattr(self.bot, '_call_chat_api'):
+            logger.error("Bot doesn't have _call_chat_api method")
+            return [[] for _ in text_contents]
+            
+        system_prompt = f"""You are an AI designed to extract meaningful information from conversations or text that would be valuable to remember for future interactions.
+
+            Instructions:
+            1. You will be given {len(text_contents)} separate conversations, each under a "### CONVERSATION n" heading. Analyze each one on its own.
+            2. Identify significant information such as:
+               - Personal preferences (likes, dislikes)
+               - Background information (job, location, family)
+               - Important events (past or planned)
+               - Goals or needs expressed
+               - Problems being faced
+               - Relationships between people
+
+            3. For each piece of significant information, output a JSON object with these key-value pairs:
+               - "topic": A short, descriptive topic name (e.g., "User's Job", "Birthday Plans")
+               - "detail": A concise factual statement summarizing what to remember
+               - "importance": A number from 1-10 indicating how important this memory is (10 being most important)
+
+            4. Format your output as a JSON array with exactly {len(text_contents)} elements, one per conversation in order. Each element is a JSON array of the objects found in that conversation.
+            5. Use an empty array [] for any conversation where nothing significant was found.
+
+            Only extract specific, factual information, and focus on details that would be useful to remember in future conversations.
+            Your output should be ONLY a valid JSON array with no additional text.
+            """
+        
+        combined_content = "\n\n".join(
+            f"### CONVERSATION {i}\n{text_content}" for i, text_content in enumerate(text_contents, 1)
+        )
+        
+        try:
+            memory_analysis = await self._analyze(combined_content, system_prompt)
+            
+            memory_sets = _parse_json(memory_analysis, "[", "]")
+            if memory_sets is None:
+                self._forget_analysis(combined_content, system_prompt)
+                logger.info("No memory-worthy information found in sleep analysis")
+                return [[] for _ in text_contents]
+            
+        except (json.JSONDecodeError, AttributeError) as e:
+            logger.warning("Failed to parse batched memory response in sleep: %s", e)
+            memory_sets = None
+        except Exception as e:
+            logger.error("Error in batched sleep memory extraction: %s", e)
+            return [[] for _ in text_contents]
+            
+        if not isinstance(memory_sets, list) or len(memory_sets) != len(text_contents) or not all(isinstance(m, list) for m in memory_sets):
+            self._forget_analysis(combined_content, system_prompt)
+            logger.warning("Batched memory response did not match the conversation count, extracting individually")
+            return [await self.collect_memories_from_text(text_content) for text_content in text_contents]
+            
+        return [self._memory_candidates(memory_data) for memory_data in memory_sets]
+        
+    async def extract_memories_from_texts(self, text_contents: List[str], guild_id: str = "global") -> List[int]:
+        memory_sets = await self.collect_memories_from_texts(text_contents)
+        memories = [memory for memory_set in memory_sets for memory in memory_set]
+        
+        created = await asyncio.to_thread(self.add_memories, memories, "Sleep Analysis", guild_id)
+        if created != len(memories):
+            return [0] * len(memory_sets)
+            
+        return [len(memory_set) for memory_set in memory_sets]
+            
+    async def queue_memories(self, memories: List[Tuple[str, str]], source: str, guild_id: str = "global") -> None:
+        # Writes from concurrent conversations are coalesced by one writer
+        # task into a single add_memories call per (source, guild) and flush.
+        if self._write_queue is None:
+            self._write_queue = asyncio.Queue(maxsize=MEMORY_QUEUE_SIZE)
+        if self._writer_task is None or self._writer_task.done():
+            self._writer_task = asyncio.create_task(self._write_queued_memories())
+            
+        for topic, detail in memories:
+            await self._write_queue.put((topic, detail, source, guild_id))
+            
+    async def _write_queued_memories(self) -> None:
+        write_queue = self._write_queue
+        loop = asyncio.get_running_loop()
+        
+        while True:
+            pending = [await write_queue.get()]
+            deadline = loop.time() + MEMORY_QUEUE_LINGER
+            while len(pending) < MEMORY_QUEUE_BATCH:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    pending.append(await asyncio.wait_for(write_queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+                    
+            groups: Dict[Tuple[str, str], List[Tuple[str, str]]] = {}
+            for topic, detail, source, guild_id in pending:
+                groups.setdefault((source, guild_id), []).append((topic, detail))
+                
+            for (source, guild_id), memories in groups.items():
+                await asyncio.to_thread(self.add_memories, memories, source, guild_id)
+                
+    def schedule_update_memory_from_conversation(self, user_name: str, user_message: str, bot_response: str, guild_id: str = "global") -> asyncio.Task:
+        # Memory extraction is an extra LLM round trip the reply does not
+        # depend on, so it runs in the background. Tasks are kept referenced
+        # until done, and the semaphore bounds how many run at once.
+        task = asyncio.create_task(
+            self._bounded_update_memory_from_conversation(user_name, user_message, bot_response, guild_id)
+        )
+        self._update_tasks.add(task)
+        task.add_done_callback(self._update_tasks.discard)
+        return task
+        
+    async def _bounded_update_memory_from_conversation(self, user_name: str, user_message: str, bot_response: str, guild_id: str) -> None:
+        async with self._update_semaphore:
+            await self.update_memory_from_conversation(user_name, user_message, bot_response, guild_id)
             
     async def update_memory_from_conversation(self, user_name: str, user_message: str, bot_response: str, guild_id: str = "global") -> None:
         if not hasattr(self.bot, 'api_integration') or not self.bot.api_integration.client or not self.bot.api_integration.chat_model:
@@ -528,82 +1040,103 @@ class ChromaMemoryManager:
                 logger.error("Bot doesn't have _call_chat_api method")
                 return
                 
-            memory_analysis = await self.bot._call_chat_api(
-                conversation_content,
-                system_prompt=system_prompt
-            )
+            memory_analysis = await self._analyze(conversation_content, system_prompt)
             
-            try:
-                json_match = re.search(r'\{.*\}', memory_analysis, re.DOTALL)
-                
-                if json_match:
-                    memory_json = json_match.group(0)
-                    memory_data = json.loads(memory_json)
-                    
-                    for topic, detail in memory_data.items():
-                        if topic and detail and len(detail) > 3:
-                            self.add_memory(topic, detail, user_name, guild_id)
-                    
-                else:
-                    logger.info("No memory-worthy information found in conversation")
-                    
-            except (json.JSONDecodeError, AttributeError) as e:
-                logger.warning(f"Failed to parse memory response: {memory_analysis}. Error: {str(e)}")
-                
         except Exception as e:
-            logger.error(f"Error updating memory from conversation: {e}")
+            logger.error("Error updating memory from conversation: %s", e)
+            return
+            
+        try:
+            memory_data = _parse_json(memory_analysis, "{", "}")
+            
+            if memory_data is None:
+                self._forget_analysis(conversation_content, system_prompt)
+                logger.info("No memory-worthy information found in conversation")
+                return
+                
+            memories = [
+                (topic, detail) for topic, detail in (
+                    (topic, _memory_text(detail)) for topic, detail in memory_data.items()
+                )
+                if topic and detail and len(detail) > 3
+            ]
+            
+        except (json.JSONDecodeError, AttributeError, TypeError) as e:
+            self._forget_analysis(conversation_content, system_prompt)
+            logger.warning("Failed to parse memory response: %s. Error: %s", memory_analysis, e)
+            return
+            
+        if not memories:
+            logger.info("No memory-worthy information found in conversation")
+            return
+            
+        await self.queue_memories(memories, user_name, guild_id)
 
+    def _display_header(self, guild_id: str) -> str:
+        # Rebuilt only if the character is renamed.
+        character_name = self.bot.character_name
+        if self._display_headers is None or self._display_headers[0] != character_name:
+            self._display_headers = (
+                character_name,
+                f"**Long-term Memory for {character_name}**:\n",
+                f"**Long-term Memory for {character_name}** **in this server (max {MAX_MEMORIES_PER_SERVER} memories):**\n"
+            )
+        return self._display_headers[1] if guild_id == "global" else self._display_headers[2]
+        
     def format_memories_for_display(self, guild_id: str = "global") -> str:
-        memory_display = f"**Long-term Memory for {self.bot.character_name}**"
-        if guild_id != "global":
-            memory_display += f" **in this server (max {MAX_MEMORIES_PER_SERVER} memories):**\n"
-        else:
-            memory_display += ":\n"
+        cached_at, cached = self._display_cache.get(guild_id, (0.0, None))
+        if cached is not None and time.monotonic() - cached_at < DISPLAY_CACHE_TTL:
+            return cached
+            
+        header = self._display_header(guild_id)
         
         try:
             collection = self.get_collection_for_guild(guild_id)
             
+            memories = []
             try:
-                results = collection.get()
+                count = collection.count()
+                if count == 0:
+                    return header + "No memories stored yet."
+                    
+                # A guild whose collection could not be opened shares the global
+                # one, so its rows have to be picked out by guild_id.
+                where = {"guild_id": guild_id} if collection is self.collection and guild_id != "global" else None
+                
+                for _, metadata in _iter_metadatas(collection, where):
+                    get = (metadata or {}).get
+                    memories.append((
+                        get('topic', 'Unknown Topic'),
+                        get('detail', ''),
+                        get('source', 'Unknown'),
+                        str(get('timestamp', ''))
+                    ))
             except Exception as e:
-                logger.error(f"Error getting memories from collection: {e}")
-                return memory_display + "Error: Could not retrieve memories from database."
+                logger.error("Error getting memories from collection: %s", e)
+                return header + "Error: Could not retrieve memories from database."
             
-            if not results or not results['metadatas'] or len(results['metadatas']) == 0:
-                memory_display += "No memories stored yet."
-                return memory_display
+            if not memories:
+                return header + "No memories stored yet."
                 
-            memories = []
-            for i, metadata in enumerate(results['metadatas']):
-                topic = metadata.get('topic', 'Unknown Topic')
-                detail = metadata.get('detail', '')
-                source = metadata.get('source', 'Unknown')
-                timestamp = metadata.get('timestamp', '')
-                
-                try:
-                    if timestamp:
-                        dt = datetime.datetime.fromisoformat(timestamp)
-                        timestamp_key = dt.timestamp()
-                    else:
-                        timestamp_key = 0
-                except ValueError:
-                    timestamp_key = 0
-                
-                memories.append((topic, detail, source, timestamp_key))
-                
-            memories.sort(key=lambda x: (-x[3], x[0]))
+            # ISO timestamps order correctly as strings. Sorting by topic first
+            # and then stably by time gives newest first, ties by topic.
+            memories.sort(key=_by_topic)
+            memories.sort(key=_by_timestamp, reverse=True)
             
-            memory_display += f"{len(memories)} memories stored. "
-            if guild_id != "global" and len(memories) >= MAX_MEMORIES_PER_SERVER:
-                memory_display += f"**Limit reached ({MAX_MEMORIES_PER_SERVER})**. Oldest memories will be replaced.\n\n"
+            memory_count = len(memories)
+            parts = [header, f"{memory_count} memories stored. "]
+            if guild_id != "global" and memory_count >= MAX_MEMORIES_PER_SERVER:
+                parts.append(f"**Limit reached ({MAX_MEMORIES_PER_SERVER})**. Oldest memories will be replaced.\n\n")
             else:
-                memory_display += "\n\n"
-                
-            for topic, detail, source, _ in memories:
-                memory_display += f"- **{topic}**: {detail} (from {source})\n"
+                parts.append("\n\n")
                 
+            format_line = "- **{}**: {} (from {})\n".format
+            parts.extend([format_line(topic, detail, source) for topic, detail, source, _ in memories])
+            memory_display = "".join(parts)
+            
+            self._display_cache[guild_id] = (time.monotonic(), memory_display)
             return memory_display
             
         except Exception as e:
-            logger.error(f"Error formatting memories for display: {e}")
-            return memory_display + f"Error retrieving memories: {str(e)}"
\ No newline at end of file
+            logger.error("Error formatting memories for display: %s", e)
+            return header + f"Error retrieving memories: {str(e)}"
\ No newline at end of file